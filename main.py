@@ -6,9 +6,34 @@
 # personalized carbon footprint calculations and recommendations
 
 import streamlit as st
-import base64
+import functools
+import hashlib
+import io
 import requests
 import json
+import operator
+import os
+import re
+import sqlite3
+import textwrap
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is a much faster drop-in for the JSON work done on every request
+# The standard library json module is used when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 uses SIMD kernels to encode invoice images several times faster
+# The standard library base64 module is used when it is not installed
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 # Set up the Streamlit page configuration with a wide layout for better form display
 st.set_page_config(
@@ -16,37 +41,34 @@ st.set_page_config(
     page_title="Comprehensive Carbon Footprint Calculator"
 )
 
-# API Key for accessing OpenRouter.ai to use the Gemma 3 language model
-# You can go to openrouter and get an API Key for free and past the key in the following code line
-GEMMA_API_KEY = "" # Paste your API Key here
-
-def encode_image(image_path: str) -> str:
+def read_setting(name: str, default: str = "") -> str:
     """
-    Helper function that converts an image file to base64 encoding for API transmission
-    Takes a file path and returns the encoded string or None if there's an error
-    This encoding is necessary for sending images to the LLM for receipt analysis
+    Reads a configuration value from the environment, falling back to Streamlit secrets
+    Returns the default when neither source defines it
     """
+    value = os.environ.get(name)
+    if value:
+        return value
     try:
-        with open(image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-        return encoded_image
-    except Exception as e:
-        st.error(f"Error encoding image: {str(e)}")
-        return None
+        return st.secrets[name]
+    except (KeyError, FileNotFoundError):
+        return default
 
-def analyze_with_gemma(user_responses):
-    """
-    Core analysis function that sends user activity data to Gemma 3 LLM for carbon footprint calculation
-    Takes the complete dictionary of user responses and returns a detailed markdown analysis
-    The function constructs a specialized prompt that guides the AI to calculate emissions
-    by category and provide actionable recommendations
-    """
-    prompt = f"""
+# API Key for accessing OpenRouter.ai to use the Gemma 3 language model
+# You can go to openrouter and get an API Key for free, then set it as the OPENROUTER_KEY
+# environment variable or add it to .streamlit/secrets.toml
+GEMMA_API_KEY = read_setting("OPENROUTER_KEY")
+
+# Model used for every request; override OPENROUTER_MODEL to switch variants without a code change
+OPENROUTER_MODEL = read_setting("OPENROUTER_MODEL", "google/gemma-3-4b-it:free")
+
+# Prompt for the overall carbon footprint analysis; {responses_json} is filled with the user's answers
+ANALYSIS_PROMPT_TEMPLATE = textwrap.dedent("""
     You are an expert in carbon footprint calculation. Based on the following user activities, calculate their daily carbon footprint in kg CO2e.
     Provide detailed breakdown by category and explain the calculation methodology.
     
     User's daily activities:
-    {json.dumps(user_responses, indent=2)}
+    {responses_json}
     
     Calculate the carbon footprint with these guidelines:
     1. Use region-specific emission factors where possible (assume global average if no region specified)
@@ -57,131 +79,598 @@ def analyze_with_gemma(user_responses):
     6. In the end provide some suggestions to the user on how they can reduce their carbon footprint.
     
     Format your response in markdown with clear headings and sections.
+    """)
+
+# Instructions sent alongside every food invoice image, shared by single and batched invoice analysis
+FOOD_INVOICE_PROMPT = textwrap.dedent("""
+    Analyze this food order receipt/invoice and provide:
+    
+    1. A list of all food items, classified as vegetarian or non-vegetarian
+    2. An estimate of the carbon footprint for each item using standard emission factors
+    3. The total carbon footprint of the order
+    4. Suggestions to reduce the carbon footprint of future orders
+    
+    
+    Use India-specific carbon emission factors when available.
+    """)
+
+# OpenRouter chat completions endpoint used for every Gemma 3 request
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+@st.cache_resource(show_spinner=False)
+def gemma_client() -> requests.Session:
+    """
+    One shared HTTP session for all OpenRouter requests
+    Held in st.cache_resource, so it survives script reruns and is shared by every session
+    Keep-alive connections are pooled, so only the first request pays for the TCP and TLS handshake
+    Rate limits and server errors are retried with exponential backoff, honouring Retry-After,
+    which turns most transient failures on the free tier into successes without the user resubmitting
+    Read timeouts are never retried, since the provider may already be generating (and billing) that completion
+    """
+    session = requests.Session()
+    session.headers.update({
+        "Authorization": f"Bearer {GEMMA_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://carbon-calculator.app",
+    })
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=5,
+            connect=2,
+            read=0,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+            respect_retry_after_header=True
+        )
+    ))
+    return session
+
+# Local SQLite store for completed LLM analyses
+# Identical inputs are answered from here instead of repeating a slow OpenRouter request
+LLM_CACHE_PATH = ".llm_cache.sqlite3"
+
+# Longest side in pixels that invoice images are downscaled to before being sent to the LLM
+INVOICE_MAX_SIDE = 1024
+
+# Seconds the invoice step waits for a background analysis before asking the user to check back
+INVOICE_WAIT_SECONDS = 120
+
+def open_llm_cache() -> sqlite3.Connection:
+    """
+    Opens the local LLM result store, creating its table on first use
+    """
+    conn = sqlite3.connect(LLM_CACHE_PATH)
+    conn.execute("CREATE TABLE IF NOT EXISTS llm_results (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+    return conn
+
+def load_llm_result(cache_key: str):
+    """
+    Looks up a previously stored LLM analysis by its cache key
+    Returns the stored markdown text or None if this input has not been analyzed before
+    """
+    conn = open_llm_cache()
+    try:
+        row = conn.execute("SELECT result FROM llm_results WHERE key = ?", (cache_key,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+def save_llm_result(cache_key: str, result: str):
+    """
+    Stores a completed LLM analysis so later sessions can reuse it without an API call
+    """
+    conn = open_llm_cache()
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO llm_results (key, result) VALUES (?, ?)", (cache_key, result))
+    finally:
+        conn.close()
+
+def canonical_json_bytes(data) -> bytes:
+    """
+    Serializes data as compact UTF-8 JSON with sorted keys, so equal inputs always produce the same bytes
+    Uses orjson when it is installed and the standard library otherwise, with matching output
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SORT_KEYS, default=str)
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+def canonical_json(data) -> str:
+    """
+    Text form of canonical_json_bytes
+    The same string is used both for the LLM prompt and for its cache key
+    """
+    return canonical_json_bytes(data).decode("utf-8")
+
+def parse_json(data):
+    """
+    Parses JSON from bytes or text, using orjson when it is installed
+    Both parsers raise a subclass of json.JSONDecodeError on invalid input
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# Prompt each analyzer sends, part of its cache key so editing a prompt never serves answers to the old one
+ANALYZER_PROMPTS = {
+    "analyze_with_gemma": ANALYSIS_PROMPT_TEMPLATE,
+    "analyze_food_invoice": FOOD_INVOICE_PROMPT,
+    "analyze_food_invoices_batch": FOOD_INVOICE_PROMPT,
+}
+
+def llm_cache_key(name: str, *args) -> str:
+    """
+    Builds the cache key for an LLM analysis from the analyzer name, the configured model,
+    the analyzer's prompt and its arguments
+    Switching OPENROUTER_MODEL or editing a prompt therefore starts from fresh results
+    Arguments are canonicalized as sorted-key JSON so equal inputs always map to the same blake2b digest
+    """
+    return hashlib.blake2b(
+        canonical_json_bytes([name, OPENROUTER_MODEL, ANALYZER_PROMPTS.get(name, ""), *args])
+    ).hexdigest()
+
+def persist_llm_result(func):
+    """
+    Decorator that keeps successful LLM analyses in the local SQLite store
+    The cache key is a blake2b digest of the function name, model, prompt and canonicalized JSON arguments,
+    so the same form answers or the same invoice image never trigger a second API request
+    Failed requests raise instead of returning, which keeps errors out of the cache
+    """
+    @functools.wraps(func)
+    def wrapper(*args):
+        cache_key = llm_cache_key(func.__name__, *args)
+        cached = load_llm_result(cache_key)
+        if cached is not None:
+            return cached
+        result = func(*args)
+        save_llm_result(cache_key, result)
+        return result
+    return wrapper
+
+def compress_image(image_bytes: bytes) -> bytes:
+    """
+    Shrinks a receipt image before it is sent to the LLM, working entirely in memory
+    The image is converted to grayscale, downscaled and re-encoded as WebP,
+    which keeps the text readable while cutting the upload and image tokens many times over
+    JPEG photos are decoded straight to a reduced grayscale size, so full-resolution pixels are never built
+    The EXIF orientation is applied before re-encoding, since WebP output drops the tag phone photos rely on
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (INVOICE_MAX_SIDE, INVOICE_MAX_SIDE))
+    image = ImageOps.exif_transpose(image).convert("L")
+    image.thumbnail((INVOICE_MAX_SIDE, INVOICE_MAX_SIDE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, "WEBP", quality=75, method=6)
+    return buffer.getvalue()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def encode_image_bytes(image_bytes: bytes) -> str:
+    """
+    Helper function that converts raw image bytes to base64 encoding for API transmission
+    The image is compressed in memory first and the encoded string is returned
+    This encoding is necessary for sending images to the LLM for receipt analysis
+    Cached per image, so retrying after a failed request does not compress and encode it again
+    Raises OSError if the bytes are not a readable image
+    """
+    return base64.b64encode(compress_image(image_bytes)).decode("ascii")
+
+# Locations where different LLM providers put the generated text, tried in order
+# after the OpenAI-style choices[0].message.content that OpenRouter returns
+CONTENT_FALLBACK_PATHS = (
+    ("choices", 0, "text"),
+    ("response",),
+    ("result",),
+    ("output",),
+    ("text",),
+)
+
+def raise_for_model_error(response_json):
+    """
+    Raises RuntimeError with the provider's message when an OpenRouter reply or stream event
+    carries an "error" object, which can happen even on HTTP 200
     """
+    if isinstance(response_json, dict) and "error" in response_json:
+        error = response_json["error"]
+        message = error.get("message", error) if isinstance(error, dict) else error
+        raise RuntimeError(f"The model returned an error: {message}")
+
+def extract_content(response_json):
+    """
+    Pulls the generated text out of a chat completion response
+    Checks the common OpenRouter shape first and only then walks the fallback locations
+    Raises RuntimeError when the provider reports an error, returns no text or uses an unknown shape,
+    so none of these is ever stored in the LLM cache
+    """
+    raise_for_model_error(response_json)
     
     try:
-        # Send request to OpenRouter API to access Gemma 3 model
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {GEMMA_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://carbon-calculator.app",
-                "X-Title": "Carbon Footprint Calculator",
-            },
-            json={
-                "model": "google/gemma-3-4b-it:free",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
-            },
-            timeout=90
-        )
-        
-        # Handle the API response with comprehensive error checking
-        # Different LLM providers may return results in different formats
-        if response.status_code == 200:
+        content = response_json["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        for path in CONTENT_FALLBACK_PATHS:
             try:
-                # Parse the JSON response
-                response_json = response.json()
-                
-                # Try to extract content from different possible response formats
-                if 'choices' in response_json and len(response_json['choices']) > 0:
-                    if 'message' in response_json['choices'][0] and 'content' in response_json['choices'][0]['message']:
-                        return response_json['choices'][0]['message']['content']
-                    elif 'text' in response_json['choices'][0]:
-                        return response_json['choices'][0]['text']
-                elif 'response' in response_json:
-                    return response_json['response']
-                elif 'result' in response_json:
-                    return response_json['result']
-                elif 'output' in response_json:
-                    return response_json['output']
-                elif 'text' in response_json:
-                    return response_json['text']
-                
-                # If we can't find the content in any expected location, return the raw JSON as text
-                return json.dumps(response_json, indent=2)
-            except json.JSONDecodeError:
-                # If not valid JSON, return the text directly
-                return response.text
+                content = functools.reduce(operator.getitem, path, response_json)
+                break
+            except (KeyError, IndexError, TypeError):
+                continue
         else:
-            return f"Error {response.status_code}: The API request failed. Please try again later."
-            
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
+            raise RuntimeError("The model returned a response without any generated text")
+    
+    if not isinstance(content, str) or not content.strip():
+        raise RuntimeError("The model returned an empty response")
+    return content
+
+def post_chat_completion(title: str, body: bytes, stream: bool = False):
+    """
+    Sends a chat completion request to OpenRouter through the shared session
+    Transient 429/5xx responses are retried by the session, so any error left over is a real failure
+    and is raised as RuntimeError
+    Returns the generated text, or with stream=True the open response for reading server-sent events
+    """
+    try:
+        response = gemma_client().post(
+            url=OPENROUTER_URL,
+            headers={"X-Title": title},
+            data=body,
+            timeout=90,
+            stream=stream
+        )
+        response.raise_for_status()
+    except requests.RequestException as e:
+        raise RuntimeError(f"The API request failed: {str(e)}") from e
+    
+    if stream:
+        return response
+    
+    # Different LLM providers may return results in different formats
+    try:
+        # Parse the JSON response and pull out the generated text
+        return extract_content(parse_json(response.content))
+    except json.JSONDecodeError:
+        # If not valid JSON, return the text directly
+        if not response.text.strip():
+            raise RuntimeError("The model returned an empty response")
+        return response.text
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def analysis_payload(responses_json: str, stream: bool = False) -> bytes:
+    """
+    Builds the OpenRouter request body for a footprint analysis as ready-to-send JSON bytes
+    Cached per input, so retrying or recalculating the same answers reuses the body instead of
+    formatting the prompt and serializing the request again
+    """
+    payload = {
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "user", "content": ANALYSIS_PROMPT_TEMPLATE.format(responses_json=responses_json)}
+        ],
+    }
+    if stream:
+        payload["stream"] = True
+    return canonical_json_bytes(payload)
 
+def analysis_cache_key(responses_json: str) -> str:
+    """
+    Key under which analyze_with_gemma persists its result for these answers
+    Shared with stream_with_gemma and the results page, so all three agree on model and prompt
+    """
+    return llm_cache_key("analyze_with_gemma", responses_json)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+@persist_llm_result
+def analyze_with_gemma(responses_json: str):
+    """
+    Core analysis function that sends user activity data to Gemma 3 LLM for carbon footprint calculation
+    Takes the complete user responses as canonical JSON and returns a detailed markdown analysis
+    The request uses a specialized prompt that guides the AI to calculate emissions
+    by category and provide actionable recommendations
+    Results are cached per input, and a failed API request raises an exception
+    """
+    # Send request to OpenRouter API to access Gemma 3 model
+    return post_chat_completion("Carbon Footprint Calculator", analysis_payload(responses_json))
+
+def stream_with_gemma(responses_json: str):
+    """
+    Streaming variant of analyze_with_gemma for results that are not cached yet
+    Requests server-sent events from OpenRouter and yields the markdown analysis chunk by chunk,
+    so the first tokens can be shown while the rest of the response is still being generated
+    The completed text is stored under the same cache key as analyze_with_gemma
+    """
+    # Send a streaming request to OpenRouter API to access Gemma 3 model
+    response = post_chat_completion(
+        "Carbon Footprint Calculator", analysis_payload(responses_json, stream=True), stream=True
+    )
+    
+    # Each event line looks like "data: {...}"; other lines are keep-alive comments
+    chunks = []
+    with response:
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            # A provider failing mid-stream sends an error event; keep-alive chunks may have no choices
+            event = parse_json(data)
+            raise_for_model_error(event)
+            if not event.get("choices"):
+                continue
+            content = event["choices"][0].get("delta", {}).get("content")
+            if content:
+                chunks.append(content)
+                yield content
+    
+    # A stream without any text is as much a failure as an empty non-streaming reply
+    result = "".join(chunks)
+    if not result.strip():
+        raise RuntimeError("The model returned an empty response")
+    save_llm_result(analysis_cache_key(responses_json), result)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+@persist_llm_result
 def analyze_food_invoice(image_data: str) -> str:
     """
     Specialized function that sends a food receipt/invoice image to Gemma 3 for analysis
     Takes base64-encoded image data and returns a detailed breakdown of the food carbon footprint
     The LLM identifies food items, classifies them, and estimates their environmental impact
+    Results are cached per image, and a failed API request raises an exception
     """
-    prompt_instruction = """
-    Analyze this food order receipt/invoice and provide:
+    # Send request to OpenRouter API with both text instructions and image data
+    return post_chat_completion("Food Carbon Footprint Analyzer", canonical_json_bytes({
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "user", "content": [
+                {"type": "text", "text": FOOD_INVOICE_PROMPT},
+                {"type": "image_url", "image_url": {"url": f"data:image/webp;base64,{image_data}"}}
+            ]}
+        ],
+    }))
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+@persist_llm_result
+def analyze_food_invoices_batch(images) -> str:
+    """
+    Sends several food receipt/invoice images to Gemma 3 in a single request
+    Takes a list of (meal label, base64-encoded image data) pairs and returns one markdown analysis
+    with a section per image, headed by its meal label; use split_invoice_sections to separate them
+    Sharing one request means the instructions and connection overhead are paid once for all images
+    """
+    labels = ", ".join(label for label, _ in images)
+    content = [{"type": "text", "text": (
+        f"{FOOD_INVOICE_PROMPT}\n"
+        f"You are given {len(images)} receipts, in this order: {labels}.\n"
+        "Return one section per image, each starting with a level-2 heading containing only its meal label."
+    )}]
+    content += [
+        {"type": "image_url", "image_url": {"url": f"data:image/webp;base64,{image_data}"}}
+        for _, image_data in images
+    ]
+    
+    # Send one request to OpenRouter API with the instructions followed by every image
+    return post_chat_completion("Food Carbon Footprint Analyzer", canonical_json_bytes({
+        "model": OPENROUTER_MODEL,
+        "messages": [
+            {"role": "user", "content": content}
+        ],
+    }))
+
+def split_invoice_sections(analysis: str, labels):
+    """
+    Splits a batched invoice analysis into per-meal sections using its level-2 meal-label headings
+    Deeper or longer headings that mention a meal stay inside the current section, and any text
+    before the first meal heading is kept at the top of the first section
+    Returns a dict of meal label to markdown section; if the model did not label every meal,
+    the whole analysis is returned under a combined label so nothing is lost
+    """
+    heading = re.compile(
+        r"^##\s*(" + "|".join(re.escape(label) for label in labels) + r")\s*$",
+        re.MULTILINE | re.IGNORECASE
+    )
+    matches = list(heading.finditer(analysis))
+    sections = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        label = next(label for label in labels if label.lower() == match.group(1).lower())
+        end = next_match.start() if next_match else len(analysis)
+        section = analysis[match.end():end].strip()
+        sections[label] = f"{sections[label]}\n\n{section}" if label in sections else section
+    
+    if len(sections) != len(labels):
+        return {" & ".join(labels): analysis.strip()}
+    
+    preamble = analysis[:matches[0].start()].strip()
+    if preamble:
+        first_label = next(iter(sections))
+        sections[first_label] = f"{preamble}\n\n{sections[first_label]}"
+    return {label: sections[label] for label in labels}
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def cached_invoice_analysis(invoices):
+    """
+    Analyzes uploaded food invoices straight from their raw bytes
+    Takes a list of (meal label, image bytes) pairs and returns a dict of meal label to markdown analysis
+    Streamlit hashes the bytes for the cache key, so re-analyzing the same receipts within the hour
+    skips compression, encoding and the API call entirely
+    A single invoice uses analyze_food_invoice, several are batched into one request
+    """
+    images = [(label, encode_image_bytes(image_bytes)) for label, image_bytes in invoices]
+    if len(images) == 1:
+        ((label, base64_image),) = images
+        return {label: analyze_food_invoice(base64_image)}
+    return split_invoice_sections(analyze_food_invoices_batch(images), [label for label, _ in images])
+
+@st.cache_resource
+def invoice_executor() -> ThreadPoolExecutor:
+    """
+    Worker threads that analyze invoices in the background, shared by all sessions
+    """
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="invoice")
+
+def start_invoice_analysis(invoices):
+    """
+    Starts analyzing the uploaded invoices in the background as soon as they are uploaded
+    Returns a future holding the result of cached_invoice_analysis for these invoices
+    The job is kept in session state, so reruns with the same uploads reuse it and a failed one is retried
+    """
+    job = st.session_state.invoice_job
+    if job is None or job[0] != invoices or (job[1].done() and job[1].exception() is not None):
+        job = (invoices, invoice_executor().submit(cached_invoice_analysis, invoices))
+        st.session_state.invoice_job = job
+    return job[1]
+
+# Emission factors in kg CO2e per km travelled (per vehicle for cars, per passenger otherwise)
+# used by the rule-based quick estimate
+EMISSION_FACTORS = {
+    "Car": 0.192,
+    "Motorcycle": 0.103,
+    "Bus": 0.089,
+    "Train": 0.041,
+    "Airplane": 0.255,
+    "Bicycle": 0.0,
+    "Walking": 0.0,
+}
+
+# Typical electricity draw in kWh per hour of air conditioning and of electric heating
+AC_KWH_PER_HOUR = 1.5
+HEATING_KWH_PER_HOUR = 2.0
+
+# Global average grid electricity intensity in kg CO2e per kWh
+GRID_EMISSION_FACTOR = 0.475
+
+# Global average daily footprint in kg CO2e that results are compared against
+GLOBAL_DAILY_AVERAGE = 12.3
+
+# Answers that describe the user's activities today; if none are given there is nothing to analyze
+ACTIVITY_QUESTIONS = (
+    ("transportation", "distance_km"),
+    ("transportation", "duration_minutes"),
+    ("food", "had_breakfast"),
+    ("food", "had_lunch"),
+    ("food", "had_dinner"),
+    ("food", "snacks_description"),
+    ("food", "food_waste_level"),
+    ("food", "invoice_analysis"),
+    ("energy", "ac_hours"),
+    ("energy", "heating_hours"),
+    ("water", "shower_minutes"),
+    ("water", "did_laundry"),
+    ("water", "laundry_loads"),
+    ("water", "used_dishwasher"),
+    ("consumption", "purchased_items"),
+    ("consumption", "ordered_online"),
+    ("waste", "recycling_percentage"),
+    ("waste", "does_compost"),
+    ("waste", "single_use_plastic_count"),
+)
+
+# Activities the quick estimate can price on its own with the factors above
+QUICK_ESTIMATE_QUESTIONS = {
+    ("transportation", "distance_km"),
+    ("energy", "ac_hours"),
+    ("energy", "heating_hours"),
+}
+
+def has_reported_activity(user_responses) -> bool:
+    """
+    Checks whether the user reported any activity at all, so an empty form never reaches the LLM
+    Takes the flat (category, question) response dictionary
+    """
+    return any(user_responses.get(question) for question in ACTIVITY_QUESTIONS)
+
+def quick_estimate(user_responses):
+    """
+    Rule-based footprint for sparse forms that only report travel distance and heating/cooling hours
+    Takes the flat (category, question) response dictionary and returns a markdown summary,
+    or None when the answers need the LLM: other activities, an unlisted transport mode,
+    an electric or hybrid vehicle, or electricity from non-grid sources
+    """
+    reported = {question for question in ACTIVITY_QUESTIONS if user_responses.get(question)}
+    if not reported or not reported <= QUICK_ESTIMATE_QUESTIONS:
+        return None
     
-    1. A list of all food items, classified as vegetarian or non-vegetarian
-    2. An estimate of the carbon footprint for each item using standard emission factors
-    3. The total carbon footprint of the order
-    4. Suggestions to reduce the carbon footprint of future orders
+    mode = user_responses.get(("transportation", "primary_mode"), "Car")
+    distance = user_responses.get(("transportation", "distance_km"), 0.0)
+    fuel = user_responses.get(("transportation", "fuel_type"))
+    if distance and (mode not in EMISSION_FACTORS or (mode in ("Car", "Motorcycle") and fuel in ("Electric", "Hybrid"))):
+        return None
+    if set(user_responses.get(("energy", "electricity_sources"), [])) - {"Grid electricity", "Don't know"}:
+        return None
     
+    # Car emissions are shared between everyone in the vehicle
+    transport = distance * EMISSION_FACTORS.get(mode, 0.0)
+    if mode == "Car":
+        transport /= user_responses.get(("transportation", "passengers"), 1)
     
-    Use India-specific carbon emission factors when available.
-    """
+    # Household energy is shared between everyone living in the home
+    ac_hours = user_responses.get(("energy", "ac_hours"), 0)
+    heating_hours = user_responses.get(("energy", "heating_hours"), 0)
+    energy_kwh = ac_hours * AC_KWH_PER_HOUR + heating_hours * HEATING_KWH_PER_HOUR
+    energy = energy_kwh * GRID_EMISSION_FACTOR / user_responses.get(("home", "household_size"), 1)
     
-    try:
-        # Send request to OpenRouter API with both text instructions and image data
-        response = requests.post(
-            url="https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {GEMMA_API_KEY}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": "https://carbon-calculator.app",
-                "X-Title": "Food Carbon Footprint Analyzer",
-            },
-            json={
-                "model": "google/gemma-3-4b-it:free",
-                "messages": [
-                    {"role": "user", "content": [
-                        {"type": "text", "text": prompt_instruction},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_data}"}}
-                    ]}
-                ],
-            },
-            timeout=90
-        )
-        
-        # Process the response with similar error handling as the main analysis function
-        if response.status_code == 200:
-            try:
-                # Parse the JSON response
-                response_json = response.json()
-                
-                # Try to extract content from different possible response formats
-                if 'choices' in response_json and len(response_json['choices']) > 0:
-                    if 'message' in response_json['choices'][0] and 'content' in response_json['choices'][0]['message']:
-                        return response_json['choices'][0]['message']['content']
-                    elif 'text' in response_json['choices'][0]:
-                        return response_json['choices'][0]['text']
-                elif 'response' in response_json:
-                    return response_json['response']
-                elif 'result' in response_json:
-                    return response_json['result']
-                elif 'output' in response_json:
-                    return response_json['output']
-                elif 'text' in response_json:
-                    return response_json['text']
-                
-                # If we can't find the content in any expected location, return the raw JSON as text
-                return json.dumps(response_json, indent=2)
-            except json.JSONDecodeError:
-                # If not valid JSON, return the text directly
-                return response.text
-        else:
-            return f"Error {response.status_code}: The API request failed. Please try again later."
-            
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
+    total = transport + energy
+    return f"""## Quick Carbon Footprint Estimate
+
+Your answers only cover travel and heating/cooling, so this estimate uses standard emission factors instead of a full AI analysis.
+
+| Category | kg CO2e |
+|---|---|
+| Transportation ({mode}, {distance:g} km) | {transport:.2f} |
+| Home energy ({ac_hours} h cooling, {heating_hours} h heating) | {energy:.2f} |
+| **Total** | **{total:.2f}** |
+
+That is {total / GLOBAL_DAILY_AVERAGE:.0%} of the global average of {GLOBAL_DAILY_AVERAGE} kg CO2e per day.
+Fill in the food and consumer goods sections for a complete analysis.
+"""
+
+# Fixed answer options for the form widgets, built once at import instead of on every rerun
+# Each *_INDEX maps an option to its position so restoring a saved answer is a single dict lookup
+TRANSPORT_OPTIONS = ("Car", "Bus", "Train", "Bicycle", "Walking", "Motorcycle", "Airplane", "Other")
+TRANSPORT_INDEX = {option: i for i, option in enumerate(TRANSPORT_OPTIONS)}
+
+FUEL_OPTIONS = ("Petrol/Gasoline", "Diesel", "Electric", "Hybrid", "CNG/LPG")
+FUEL_INDEX = {option: i for i, option in enumerate(FUEL_OPTIONS)}
+
+DIET_OPTIONS = (
+    "Omnivore (regular meat consumption)",
+    "Flexitarian (occasional meat)",
+    "Pescatarian (fish but no meat)",
+    "Vegetarian (no meat or fish)",
+    "Vegan (no animal products)",
+)
+DIET_INDEX = {option: i for i, option in enumerate(DIET_OPTIONS)}
+
+LUNCH_SOURCE_OPTIONS = (
+    "Home-cooked",
+    "Restaurant",
+    "Office/School Cafeteria",
+    "Delivery/Takeout",
+    "Other",
+)
+LUNCH_SOURCE_INDEX = {option: i for i, option in enumerate(LUNCH_SOURCE_OPTIONS)}
+
+DINNER_SOURCE_OPTIONS = ("Home-cooked", "Restaurant", "Delivery/Takeout", "Other")
+DINNER_SOURCE_INDEX = {option: i for i, option in enumerate(DINNER_SOURCE_OPTIONS)}
+
+HOME_TYPE_OPTIONS = ("Apartment", "Small house", "Medium house", "Large house", "Other")
+HOME_TYPE_INDEX = {option: i for i, option in enumerate(HOME_TYPE_OPTIONS)}
+
+LAUNDRY_TEMP_OPTIONS = ("Cold", "Warm", "Hot")
+LAUNDRY_TEMP_INDEX = {option: i for i, option in enumerate(LAUNDRY_TEMP_OPTIONS)}
+
+ITEMS_NEW_OPTIONS = ("All new", "Mixture of new and second-hand", "All second-hand")
+
+PACKAGING_OPTIONS = ("Minimal/eco-friendly packaging", "Standard packaging", "Excessive packaging")
+
+DELIVERY_OPTIONS = ("Standard", "Express/Next day", "Same day")
+
+# Static recommendations shown under the results, built once instead of on every rerun
+NEXT_STEPS_MD = """
+- Track your footprint over time to see your progress
+- Set goals to reduce your highest impact areas
+- Share your journey with friends and family to inspire change
+"""
 
 # Initialize session state variables to maintain app state between reruns
 # These variables track the current step, user responses, and analysis results
@@ -191,34 +680,120 @@ if 'current_step' not in st.session_state:
 if 'user_responses' not in st.session_state:
     st.session_state.user_responses = {}
     
+# Bumped whenever an answer changes, so the serialized responses are only rebuilt when needed
+if 'responses_version' not in st.session_state:
+    st.session_state.responses_version = 0
+    
 if 'food_order_analysis' not in st.session_state:
     st.session_state.food_order_analysis = None
     
+# Invoices being analyzed in the background and the future holding their analysis
+if 'invoice_job' not in st.session_state:
+    st.session_state.invoice_job = None
+    
 if 'final_result' not in st.session_state:
     st.session_state.final_result = None
+    
+# Set when Step 4 is submitted without a lunch or dinner invoice, so navigation can skip Step 5
+if 'skip_invoice' not in st.session_state:
+    st.session_state.skip_invoice = False
+
+# Hash of the answers the final result was calculated from, so edits made afterwards trigger a recalculation
+if 'final_result_key' not in st.session_state:
+    st.session_state.final_result_key = None
 
 # Helper function to safely get responses with default values
-# This prevents errors when accessing data that might not exist yet
+# Responses are stored flat, keyed by (category, question), so a lookup is a single dict access
 def get_response(category, question, default=None):
-    if category in st.session_state.user_responses:
-        if question in st.session_state.user_responses[category]:
-            return st.session_state.user_responses[category][question]
-    return default
+    return st.session_state.user_responses.get((category, question), default)
 
 # Function to store responses in the session state
-# Organizes data hierarchically by category and question
+# Each answer is keyed by its (category, question) pair
 def store_response(category, question, response):
-    if category not in st.session_state.user_responses:
-        st.session_state.user_responses[category] = {}
-    st.session_state.user_responses[category][question] = response
+    key = (category, question)
+    if key not in st.session_state.user_responses or st.session_state.user_responses[key] != response:
+        st.session_state.user_responses[key] = response
+        st.session_state.responses_version += 1
+
+# Stores a batch of answers keyed by (category, question), such as everything a form submitted
+# store_response skips unchanged answers, so only the ones the user actually edited are written
+def store_responses(answers):
+    for (category, question), response in answers.items():
+        store_response(category, question, response)
+
+# Records a widget's initial value when the question has not been answered yet
+# Later changes arrive through the widget's on_change callback instead of on every rerun
+def store_default_response(category, question, response):
+    if (category, question) not in st.session_state.user_responses:
+        store_response(category, question, response)
+
+# Seeds a keyed widget with the stored answer the first time it is shown, falling back to the default
+# for missing answers or ones that are no longer among the widget's options
+# Afterwards Streamlit keeps the widget's own value, so the stored answer is not looked up on every rerun
+def seed_widget(widget_key, category, question, default, options=None):
+    if widget_key not in st.session_state:
+        response = get_response(category, question, default)
+        if options is not None and response not in options:
+            response = default
+        st.session_state[widget_key] = response
+
+# Widget on_change callback that copies the widget's new value into the stored responses
+# Streamlit only calls it when the value actually changes, not on unrelated reruns
+def on_widget_change(category, question, widget_key):
+    store_response(category, question, st.session_state[widget_key])
+
+# Rebuilds the hierarchical category -> question -> answer form of the responses
+# Used once per analysis, since the LLM prompt and cache keys need JSON-friendly nesting
+def nest_responses(user_responses):
+    nested = {}
+    for (category, question), response in user_responses.items():
+        nested.setdefault(category, {})[question] = response
+    return nested
+
+# Drops empty answers (blank text, empty selections, unchecked boxes, zero amounts) and empty categories
+# Shorter prompts mean fewer input tokens, less latency and lower cost per analysis
+def prune_responses(data):
+    pruned = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            value = prune_responses(value)
+        if value not in (None, "", [], {}, False, 0):
+            pruned[key] = value
+    return pruned
+
+# Returns the responses as canonical JSON for the LLM prompt and cache key
+# The string is kept in the session and only re-serialized after an answer has changed
+def serialized_responses():
+    if st.session_state.get("serialized_version") != st.session_state.responses_version:
+        st.session_state.serialized_responses = canonical_json(
+            prune_responses(nest_responses(st.session_state.user_responses))
+        )
+        st.session_state.serialized_version = st.session_state.responses_version
+    return st.session_state.serialized_responses
 
 # Navigation functions to move between form steps
+# The food invoice step is skipped in both directions when there is no invoice to upload
 def next_step():
     st.session_state.current_step += 1
+    if st.session_state.current_step == 5 and st.session_state.skip_invoice:
+        st.session_state.current_step += 1
     
 def prev_step():
     if st.session_state.current_step > 1:
         st.session_state.current_step -= 1
+        if st.session_state.current_step == 5 and st.session_state.skip_invoice:
+            st.session_state.current_step -= 1
+
+# Renders the Previous/Next buttons shared by the form steps
+# Steps are fragments, so changing step needs an explicit full-app rerun to show the new one
+def nav_bar(step, next_label):
+    cols = st.columns([1, 1, 5])
+    if step > 1 and cols[0].button("Previous", key=f"prev_{step}", use_container_width=True):
+        prev_step()
+        st.rerun()
+    if cols[1 if step > 1 else 0].button(next_label, key=f"next_{step}", use_container_width=True):
+        next_step()
+        st.rerun()
 
 # Main Streamlit UI header and description
 st.title("Comprehensive Carbon Footprint Calculator")
@@ -228,46 +803,39 @@ Answer the questions below to get a detailed analysis of your environmental impa
 """)
 
 # Step 1: Transportation - Collects information about how the user travels
-if st.session_state.current_step == 1:
+@st.fragment
+def step_transportation():
     st.header("Transportation")
     
-    # Initialize transportation category if needed
-    if "transportation" not in st.session_state.user_responses:
-        st.session_state.user_responses["transportation"] = {}
-    
     # Transportation mode selection with default value handling
-    transport_options = ["Car", "Bus", "Train", "Bicycle", "Walking", "Motorcycle", "Airplane", "Other"]
     default_transport = get_response("transportation", "primary_mode", "Car")
-    try:
-        default_index = transport_options.index(default_transport)
-    except ValueError:
-        default_index = 0
+    default_index = TRANSPORT_INDEX.get(default_transport, 0)
     
     transport_mode = st.selectbox(
         "What was your primary mode of transportation today?",
-        transport_options,
+        TRANSPORT_OPTIONS,
         index=default_index,
-        key="transport_mode"
+        key="transport_mode",
+        on_change=on_widget_change,
+        args=("transportation", "primary_mode", "transport_mode")
     )
-    store_response("transportation", "primary_mode", transport_mode)
+    store_default_response("transportation", "primary_mode", transport_mode)
     
     # Conditional inputs based on transportation mode
     # Different vehicle types need different information
     if transport_mode in ["Car", "Motorcycle"]:
-        fuel_options = ["Petrol/Gasoline", "Diesel", "Electric", "Hybrid", "CNG/LPG"]
         default_fuel = get_response("transportation", "fuel_type", "Petrol/Gasoline")
-        try:
-            default_fuel_index = fuel_options.index(default_fuel)
-        except ValueError:
-            default_fuel_index = 0
+        default_fuel_index = FUEL_INDEX.get(default_fuel, 0)
             
         fuel_type = st.selectbox(
             "What type of fuel does your vehicle use?",
-            fuel_options,
+            FUEL_OPTIONS,
             index=default_fuel_index,
-            key="fuel_type"
+            key="fuel_type",
+            on_change=on_widget_change,
+            args=("transportation", "fuel_type", "fuel_type")
         )
-        store_response("transportation", "fuel_type", fuel_type)
+        store_default_response("transportation", "fuel_type", fuel_type)
     
     # Distance traveled - important for all transport modes
     distance_value = float(get_response("transportation", "distance_km", 0.0))
@@ -276,9 +844,11 @@ if st.session_state.current_step == 1:
         min_value=0.0, 
         step=0.5,
         value=distance_value,
-        key="distance"
+        key="distance",
+        on_change=on_widget_change,
+        args=("transportation", "distance_km", "distance")
     )
-    store_response("transportation", "distance_km", distance)
+    store_default_response("transportation", "distance_km", distance)
     
     # Public transport specific questions
     if transport_mode in ["Bus", "Train"]:
@@ -288,9 +858,11 @@ if st.session_state.current_step == 1:
             min_value=0, 
             step=5,
             value=duration_value,
-            key="duration"
+            key="duration",
+            on_change=on_widget_change,
+            args=("transportation", "duration_minutes", "duration")
         )
-        store_response("transportation", "duration_minutes", duration)
+        store_default_response("transportation", "duration_minutes", duration)
     
     # Car occupancy affects per-person emissions
     if transport_mode == "Car":
@@ -300,114 +872,114 @@ if st.session_state.current_step == 1:
             min_value=1, 
             step=1,
             value=passengers_value,
-            key="passengers"
+            key="passengers",
+            on_change=on_widget_change,
+            args=("transportation", "passengers", "passengers")
         )
-        store_response("transportation", "passengers", passengers)
+        store_default_response("transportation", "passengers", passengers)
     
     # Navigation button to proceed to next step
-    col1, col2 = st.columns([1, 6])
-    with col1:
-        if st.button("Next: Food & Diet", key="transport_next", use_container_width=True):
-            next_step()
+    nav_bar(1, "Next: Food & Diet")
 
 # Step 2: Food & Diet - Collects information about the user's eating habits
-elif st.session_state.current_step == 2:
+@st.fragment
+def step_food():
     st.header("Food & Diet")
     
-    # Initialize food and diet categories
-    if "food" not in st.session_state.user_responses:
-        st.session_state.user_responses["food"] = {}
-    if "diet" not in st.session_state.user_responses:
-        st.session_state.user_responses["diet"] = {}
-    
     # General diet pattern has a major impact on carbon footprint
-    diet_options = ["Omnivore (regular meat consumption)", "Flexitarian (occasional meat)", 
-                    "Pescatarian (fish but no meat)", "Vegetarian (no meat or fish)", 
-                    "Vegan (no animal products)"]
     default_diet = get_response("diet", "diet_type", "Omnivore (regular meat consumption)")
-    try:
-        default_diet_index = diet_options.index(default_diet)
-    except ValueError:
-        default_diet_index = 0
+    default_diet_index = DIET_INDEX.get(default_diet, 0)
         
     diet_type = st.selectbox(
         "How would you describe your diet?",
-        diet_options,
+        DIET_OPTIONS,
         index=default_diet_index,
-        key="diet_type"
+        key="diet_type",
+        on_change=on_widget_change,
+        args=("diet", "diet_type", "diet_type")
     )
-    store_response("diet", "diet_type", diet_type)
+    store_default_response("diet", "diet_type", diet_type)
     
     # Breakfast section
     st.subheader("Breakfast")
     had_breakfast = st.checkbox(
         "Did you have breakfast today?",
         value=get_response("food", "had_breakfast", False),
-        key="had_breakfast"
+        key="had_breakfast",
+        on_change=on_widget_change,
+        args=("food", "had_breakfast", "had_breakfast")
     )
-    store_response("food", "had_breakfast", had_breakfast)
+    store_default_response("food", "had_breakfast", had_breakfast)
     
     # Additional questions if user had breakfast
     if had_breakfast:
         breakfast = st.text_area(
             "Please describe what you ate for breakfast",
             value=get_response("food", "breakfast_description", ""),
-            key="breakfast_desc"
+            key="breakfast_desc",
+            on_change=on_widget_change,
+            args=("food", "breakfast_description", "breakfast_desc")
         )
-        store_response("food", "breakfast_description", breakfast)
+        store_default_response("food", "breakfast_description", breakfast)
         
         breakfast_dairy = st.slider(
             "How much dairy did your breakfast contain?", 
             0, 5, 
             value=int(get_response("food", "breakfast_dairy_level", 0)),
             help="0 = none, 5 = large amounts (e.g., milk, cheese, yogurt)",
-            key="breakfast_dairy"
+            key="breakfast_dairy",
+            on_change=on_widget_change,
+            args=("food", "breakfast_dairy_level", "breakfast_dairy")
         )
-        store_response("food", "breakfast_dairy_level", breakfast_dairy)
+        store_default_response("food", "breakfast_dairy_level", breakfast_dairy)
         
         breakfast_meat = st.slider(
             "How much meat/eggs did your breakfast contain?", 
             0, 5, 
             value=int(get_response("food", "breakfast_meat_level", 0)),
             help="0 = none, 5 = large amounts",
-            key="breakfast_meat"
+            key="breakfast_meat",
+            on_change=on_widget_change,
+            args=("food", "breakfast_meat_level", "breakfast_meat")
         )
-        store_response("food", "breakfast_meat_level", breakfast_meat)
+        store_default_response("food", "breakfast_meat_level", breakfast_meat)
     
     # Lunch section with source tracking
     st.subheader("Lunch")
     had_lunch = st.checkbox(
         "Did you have lunch today?",
         value=get_response("food", "had_lunch", False),
-        key="had_lunch"
+        key="had_lunch",
+        on_change=on_widget_change,
+        args=("food", "had_lunch", "had_lunch")
     )
-    store_response("food", "had_lunch", had_lunch)
+    store_default_response("food", "had_lunch", had_lunch)
     
     # Additional questions if user had lunch
     if had_lunch:
-        lunch_source_options = ["Home-cooked", "Restaurant", "Office/School Cafeteria", "Delivery/Takeout", "Other"]
         default_lunch_source = get_response("food", "lunch_source", "Home-cooked")
-        try:
-            default_lunch_source_index = lunch_source_options.index(default_lunch_source)
-        except ValueError:
-            default_lunch_source_index = 0
+        default_lunch_source_index = LUNCH_SOURCE_INDEX.get(default_lunch_source, 0)
             
         lunch_source = st.radio(
             "Where did you get your lunch?", 
-            lunch_source_options,
+            LUNCH_SOURCE_OPTIONS,
             index=default_lunch_source_index,
-            key="lunch_source"
+            key="lunch_source",
+            on_change=on_widget_change,
+            args=("food", "lunch_source", "lunch_source")
         )
-        store_response("food", "lunch_source", lunch_source)
+        store_default_response("food", "lunch_source", lunch_source)
         
         # Special handling for delivery/takeout with invoice upload option
         if lunch_source == "Delivery/Takeout":
             has_invoice = st.checkbox(
                 "Do you have the delivery invoice/receipt?",
                 value=get_response("food", "has_lunch_invoice", False),
-                key="lunch_invoice"
+                key="lunch_invoice",
+                on_change=on_widget_change,
+                args=("food", "has_lunch_invoice", "lunch_invoice")
             )
-            store_response("food", "has_lunch_invoice", has_invoice)
+            store_default_response("food", "has_lunch_invoice", has_invoice)
             
             if has_invoice:
                 st.info("You'll be able to upload the invoice in a later step.")
@@ -415,69 +987,79 @@ elif st.session_state.current_step == 2:
                 lunch_desc = st.text_area(
                     "Please describe what you ate for lunch",
                     value=get_response("food", "lunch_description", ""),
-                    key="lunch_desc"
+                    key="lunch_desc",
+                    on_change=on_widget_change,
+                    args=("food", "lunch_description", "lunch_desc")
                 )
-                store_response("food", "lunch_description", lunch_desc)
+                store_default_response("food", "lunch_description", lunch_desc)
                 
                 lunch_meat = st.slider(
                     "How much meat did your lunch contain?", 
                     0, 5, 
                     value=int(get_response("food", "lunch_meat_level", 0)),
                     help="0 = none, 5 = large amounts",
-                    key="lunch_meat"
+                    key="lunch_meat",
+                    on_change=on_widget_change,
+                    args=("food", "lunch_meat_level", "lunch_meat")
                 )
-                store_response("food", "lunch_meat_level", lunch_meat)
+                store_default_response("food", "lunch_meat_level", lunch_meat)
         else:
             lunch_desc = st.text_area(
                 "Please describe what you ate for lunch",
                 value=get_response("food", "lunch_description", ""),
-                key="lunch_desc_2"
+                key="lunch_desc_2",
+                on_change=on_widget_change,
+                args=("food", "lunch_description", "lunch_desc_2")
             )
-            store_response("food", "lunch_description", lunch_desc)
+            store_default_response("food", "lunch_description", lunch_desc)
             
             lunch_meat = st.slider(
                 "How much meat did your lunch contain?", 
                 0, 5, 
                 value=int(get_response("food", "lunch_meat_level", 0)),
                 help="0 = none, 5 = large amounts",
-                key="lunch_meat_2"
+                key="lunch_meat_2",
+                on_change=on_widget_change,
+                args=("food", "lunch_meat_level", "lunch_meat_2")
             )
-            store_response("food", "lunch_meat_level", lunch_meat)
+            store_default_response("food", "lunch_meat_level", lunch_meat)
     
     # Dinner section with similar structure to lunch
     st.subheader("Dinner")
     had_dinner = st.checkbox(
         "Did you have dinner?",
         value=get_response("food", "had_dinner", False),
-        key="had_dinner"
+        key="had_dinner",
+        on_change=on_widget_change,
+        args=("food", "had_dinner", "had_dinner")
     )
-    store_response("food", "had_dinner", had_dinner)
+    store_default_response("food", "had_dinner", had_dinner)
     
     # Additional questions if user had dinner
     if had_dinner:
-        dinner_source_options = ["Home-cooked", "Restaurant", "Delivery/Takeout", "Other"]
         default_dinner_source = get_response("food", "dinner_source", "Home-cooked")
-        try:
-            default_dinner_source_index = dinner_source_options.index(default_dinner_source)
-        except ValueError:
-            default_dinner_source_index = 0
+        default_dinner_source_index = DINNER_SOURCE_INDEX.get(default_dinner_source, 0)
             
         dinner_source = st.radio(
             "Where did you get your dinner?", 
-            dinner_source_options,
+            DINNER_SOURCE_OPTIONS,
             index=default_dinner_source_index,
-            key="dinner_source"
+            key="dinner_source",
+            on_change=on_widget_change,
+            args=("food", "dinner_source", "dinner_source")
         )
-        store_response("food", "dinner_source", dinner_source)
+        store_default_response("food", "dinner_source", dinner_source)
         
         # Similar invoice option for dinner delivery
         if dinner_source == "Delivery/Takeout":
             has_dinner_invoice = st.checkbox(
                 "Do you have the dinner delivery invoice/receipt?",
                 value=get_response("food", "has_dinner_invoice", False),
-                key="dinner_invoice"
+                key="dinner_invoice",
+                on_change=on_widget_change,
+                args=("food", "has_dinner_invoice", "dinner_invoice")
             )
-            store_response("food", "has_dinner_invoice", has_dinner_invoice)
+            store_default_response("food", "has_dinner_invoice", has_dinner_invoice)
             
             if has_dinner_invoice:
                 st.info("You'll be able to upload the invoice in a later step.")
@@ -485,43 +1067,53 @@ elif st.session_state.current_step == 2:
                 dinner_desc = st.text_area(
                     "Please describe what you ate for dinner",
                     value=get_response("food", "dinner_description", ""),
-                    key="dinner_desc"
+                    key="dinner_desc",
+                    on_change=on_widget_change,
+                    args=("food", "dinner_description", "dinner_desc")
                 )
-                store_response("food", "dinner_description", dinner_desc)
+                store_default_response("food", "dinner_description", dinner_desc)
                 
                 dinner_meat = st.slider(
                     "How much meat did your dinner contain?", 
                     0, 5, 
                     value=int(get_response("food", "dinner_meat_level", 0)),
                     help="0 = none, 5 = large amounts",
-                    key="dinner_meat"
+                    key="dinner_meat",
+                    on_change=on_widget_change,
+                    args=("food", "dinner_meat_level", "dinner_meat")
                 )
-                store_response("food", "dinner_meat_level", dinner_meat)
+                store_default_response("food", "dinner_meat_level", dinner_meat)
         else:
             dinner_desc = st.text_area(
                 "Please describe what you ate for dinner",
                 value=get_response("food", "dinner_description", ""),
-                key="dinner_desc_2"
+                key="dinner_desc_2",
+                on_change=on_widget_change,
+                args=("food", "dinner_description", "dinner_desc_2")
             )
-            store_response("food", "dinner_description", dinner_desc)
+            store_default_response("food", "dinner_description", dinner_desc)
             
             dinner_meat = st.slider(
                 "How much meat did your dinner contain?", 
                 0, 5, 
                 value=int(get_response("food", "dinner_meat_level", 0)),
                 help="0 = none, 5 = large amounts",
-                key="dinner_meat_2"
+                key="dinner_meat_2",
+                on_change=on_widget_change,
+                args=("food", "dinner_meat_level", "dinner_meat_2")
             )
-            store_response("food", "dinner_meat_level", dinner_meat)
+            store_default_response("food", "dinner_meat_level", dinner_meat)
     
     # Additional food consumption like snacks and food waste
     st.subheader("Other Food Consumption")
     snacks = st.text_area(
         "Did you have any snacks or beverages today? Please describe",
         value=get_response("food", "snacks_description", ""),
-        key="snacks"
+        key="snacks",
+        on_change=on_widget_change,
+        args=("food", "snacks_description", "snacks")
     )
-    store_response("food", "snacks_description", snacks)
+    store_default_response("food", "snacks_description", snacks)
     
     # Food waste has significant impact on overall footprint
     food_waste = st.slider(
@@ -529,43 +1121,33 @@ elif st.session_state.current_step == 2:
         0, 5, 
         value=int(get_response("food", "food_waste_level", 0)),
         help="0 = none, 5 = significant amount",
-        key="food_waste"
+        key="food_waste",
+        on_change=on_widget_change,
+        args=("food", "food_waste_level", "food_waste")
     )
-    store_response("food", "food_waste_level", food_waste)
+    store_default_response("food", "food_waste_level", food_waste)
     
     # Navigation buttons for this step
-    col1, col2, col3 = st.columns([1, 1, 5])
-    with col1:
-        if st.button("Previous", key="food_prev", use_container_width=True):
-            prev_step()
-    with col2:
-        if st.button("Next: Home Energy", key="food_next", use_container_width=True):
-            next_step()
+    nav_bar(2, "Next: Home Energy")
 
 # Step 3: Home Energy - Collects information about household energy and water usage
-elif st.session_state.current_step == 3:
+@st.fragment
+def step_home_energy():
     st.header("Home Energy")
     
-    # Initialize needed categories for this section
-    for category in ["home", "energy", "water"]:
-        if category not in st.session_state.user_responses:
-            st.session_state.user_responses[category] = {}
-    
     # Home type and size information
-    home_type_options = ["Apartment", "Small house", "Medium house", "Large house", "Other"]
     default_home_type = get_response("home", "home_type", "Apartment")
-    try:
-        default_home_type_index = home_type_options.index(default_home_type)
-    except ValueError:
-        default_home_type_index = 0
+    default_home_type_index = HOME_TYPE_INDEX.get(default_home_type, 0)
     
     home_type = st.selectbox(
         "What type of home do you live in?",
-        home_type_options,
+        HOME_TYPE_OPTIONS,
         index=default_home_type_index,
-        key="home_type"
+        key="home_type",
+        on_change=on_widget_change,
+        args=("home", "home_type", "home_type")
     )
-    store_response("home", "home_type", home_type)
+    store_default_response("home", "home_type", home_type)
     
     # Household size affects per-person footprint
     household_size = st.number_input(
@@ -573,9 +1155,11 @@ elif st.session_state.current_step == 3:
         min_value=1, 
         step=1,
         value=int(get_response("home", "household_size", 1)),
-        key="household_size"
+        key="household_size",
+        on_change=on_widget_change,
+        args=("home", "household_size", "household_size")
     )
-    store_response("home", "household_size", household_size)
+    store_default_response("home", "household_size", household_size)
     
     # Electricity sources and usage
     st.subheader("Electricity")
@@ -586,18 +1170,22 @@ elif st.session_state.current_step == 3:
         "What are your sources of electricity? (Select all that apply)",
         electricity_options,
         default=default_electricity,
-        key="electricity_source"
+        key="electricity_source",
+        on_change=on_widget_change,
+        args=("energy", "electricity_sources", "electricity_source")
     )
-    store_response("energy", "electricity_sources", electricity_source)
+    store_default_response("energy", "electricity_sources", electricity_source)
     
     # Conditional question for grid electricity users
     if "Grid electricity" in electricity_source:
         electricity_provider = st.text_input(
             "Who is your electricity provider? (Optional)",
             value=get_response("energy", "electricity_provider", ""),
-            key="electricity_provider"
+            key="electricity_provider",
+            on_change=on_widget_change,
+            args=("energy", "electricity_provider", "electricity_provider")
         )
-        store_response("energy", "electricity_provider", electricity_provider)
+        store_default_response("energy", "electricity_provider", electricity_provider)
     
     # Heating and cooling have major energy impacts
     st.subheader("Heating & Cooling")
@@ -605,17 +1193,21 @@ elif st.session_state.current_step == 3:
         "How many hours did you use air conditioning today?", 
         0, 24, 
         value=int(get_response("energy", "ac_hours", 0)),
-        key="ac_usage"
+        key="ac_usage",
+        on_change=on_widget_change,
+        args=("energy", "ac_hours", "ac_usage")
     )
-    store_response("energy", "ac_hours", ac_usage)
+    store_default_response("energy", "ac_hours", ac_usage)
     
     heating_usage = st.slider(
         "How many hours did you use heating today?", 
         0, 24, 
         value=int(get_response("energy", "heating_hours", 0)),
-        key="heating_usage"
+        key="heating_usage",
+        on_change=on_widget_change,
+        args=("energy", "heating_hours", "heating_usage")
     )
-    store_response("energy", "heating_hours", heating_usage)
+    store_default_response("energy", "heating_hours", heating_usage)
     
     # Water usage tracking
     st.subheader("Water Usage")
@@ -624,17 +1216,21 @@ elif st.session_state.current_step == 3:
         min_value=0, 
         step=1,
         value=int(get_response("water", "shower_minutes", 0)),
-        key="shower_duration"
+        key="shower_duration",
+        on_change=on_widget_change,
+        args=("water", "shower_minutes", "shower_duration")
     )
-    store_response("water", "shower_minutes", shower_duration)
+    store_default_response("water", "shower_minutes", shower_duration)
     
     # Laundry water and energy usage
     laundry = st.checkbox(
         "Did you do laundry today?",
         value=get_response("water", "did_laundry", False),
-        key="did_laundry"
+        key="did_laundry",
+        on_change=on_widget_change,
+        args=("water", "did_laundry", "did_laundry")
     )
-    store_response("water", "did_laundry", laundry)
+    store_default_response("water", "did_laundry", laundry)
     
     # Additional laundry questions if applicable
     if laundry:
@@ -643,234 +1239,239 @@ elif st.session_state.current_step == 3:
             min_value=1, 
             step=1,
             value=int(get_response("water", "laundry_loads", 1)),
-            key="laundry_loads"
+            key="laundry_loads",
+            on_change=on_widget_change,
+            args=("water", "laundry_loads", "laundry_loads")
         )
-        store_response("water", "laundry_loads", laundry_loads)
+        store_default_response("water", "laundry_loads", laundry_loads)
         
         # Water temperature affects energy usage significantly
-        laundry_temp_options = ["Cold", "Warm", "Hot"]
         default_temp = get_response("water", "laundry_temperature", "Cold")
-        try:
-            default_temp_index = laundry_temp_options.index(default_temp)
-        except ValueError:
-            default_temp_index = 0
+        default_temp_index = LAUNDRY_TEMP_INDEX.get(default_temp, 0)
             
         laundry_temp = st.select_slider(
             "At what temperature?", 
-            options=laundry_temp_options,
-            value=laundry_temp_options[default_temp_index],
-            key="laundry_temp"
+            options=LAUNDRY_TEMP_OPTIONS,
+            value=LAUNDRY_TEMP_OPTIONS[default_temp_index],
+            key="laundry_temp",
+            on_change=on_widget_change,
+            args=("water", "laundry_temperature", "laundry_temp")
         )
-        store_response("water", "laundry_temperature", laundry_temp)
+        store_default_response("water", "laundry_temperature", laundry_temp)
     
     # Dishwasher usage tracking
     dishwasher = st.checkbox(
         "Did you use a dishwasher today?",
         value=get_response("water", "used_dishwasher", False),
-        key="used_dishwasher"
+        key="used_dishwasher",
+        on_change=on_widget_change,
+        args=("water", "used_dishwasher", "used_dishwasher")
     )
-    store_response("water", "used_dishwasher", dishwasher)
+    store_default_response("water", "used_dishwasher", dishwasher)
     
     # Navigation buttons for this step
-    col1, col2, col3 = st.columns([1, 1, 5])
-    with col1:
-        if st.button("Previous", key="energy_prev", use_container_width=True):
-            prev_step()
-    with col2:
-        if st.button("Next: Consumer Goods", key="energy_next", use_container_width=True):
-            next_step()
+    nav_bar(3, "Next: Consumer Goods")
 
 # Step 4: Consumer Goods - Collects information about purchases and waste management
-elif st.session_state.current_step == 4:
+@st.fragment
+def step_consumer_goods():
     st.header("Consumer Goods")
     
-    # Initialize needed categories for consumption and waste
-    for category in ["consumption", "waste"]:
-        if category not in st.session_state.user_responses:
-            st.session_state.user_responses[category] = {}
-    
     # Shopping habits and purchases
+    # These two answers decide which follow-up questions are shown, so they stay outside the form
+    # and are stored as soon as they change
     purchased_options = ["Clothing", "Electronics", "Furniture", "Books/Media", "Toys", "Household items", "None"]
-    default_purchased = get_response("consumption", "purchased_items", [])
-    
+    seed_widget("purchased_items", "consumption", "purchased_items", [])
     purchased_items = st.multiselect(
         "Did you purchase any of the following items today? (Select all that apply)",
         purchased_options,
-        default=default_purchased,
-        key="purchased_items"
+        key="purchased_items",
+        on_change=on_widget_change,
+        args=("consumption", "purchased_items", "purchased_items")
     )
-    store_response("consumption", "purchased_items", purchased_items)
-    
-    # Additional questions if user made purchases
-    if "None" not in purchased_items and purchased_items:
-        # New vs. second-hand has major impact on footprint
-        items_new_options = ["All new", "Mixture of new and second-hand", "All second-hand"]
-        default_items_new = get_response("consumption", "items_new_or_used", "All new")
-        try:
-            default_items_new_index = items_new_options.index(default_items_new)
-        except ValueError:
-            default_items_new_index = 0
-            
-        items_new = st.radio(
-            "Were these items new or second-hand?", 
-            items_new_options,
-            index=default_items_new_index,
-            key="items_new"
-        )
-        store_response("consumption", "items_new_or_used", items_new)
-        
-        # Packaging impacts waste footprint
-        packaging_options = ["Minimal/eco-friendly packaging", "Standard packaging", "Excessive packaging"]
-        default_packaging = get_response("consumption", "item_packaging", "Standard packaging")
-        try:
-            default_packaging_index = packaging_options.index(default_packaging)
-        except ValueError:
-            default_packaging_index = 1
-            
-        item_packaging = st.radio(
-            "How was the packaging of these items?",
-            packaging_options,
-            index=default_packaging_index,
-            key="item_packaging"
-        )
-        store_response("consumption", "item_packaging", item_packaging)
+    store_default_response("consumption", "purchased_items", purchased_items)
     
     # Online shopping has transportation impacts
+    seed_widget("ordered_online", "consumption", "ordered_online", False)
     online_shopping = st.checkbox(
         "Did you order anything online today?",
-        value=get_response("consumption", "ordered_online", False),
-        key="ordered_online"
+        key="ordered_online",
+        on_change=on_widget_change,
+        args=("consumption", "ordered_online", "ordered_online")
     )
-    store_response("consumption", "ordered_online", online_shopping)
-    
-    # Delivery speed affects carbon footprint
-    if online_shopping:
-        delivery_options = ["Standard", "Express/Next day", "Same day"]
-        default_delivery = get_response("consumption", "delivery_option", "Standard")
-        try:
-            default_delivery_index = delivery_options.index(default_delivery)
-        except ValueError:
-            default_delivery_index = 0
+    store_default_response("consumption", "ordered_online", online_shopping)
+    
+    made_purchases = "None" not in purchased_items and bool(purchased_items)
+    
+    # The remaining questions are collected in one form so answering them costs a single rerun on submit
+    with st.form("goods_form"):
+        # Additional questions if user made purchases
+        if made_purchases:
+            # New vs. second-hand has major impact on footprint
+            seed_widget("items_new", "consumption", "items_new_or_used", "All new", ITEMS_NEW_OPTIONS)
+            items_new = st.radio(
+                "Were these items new or second-hand?", 
+                ITEMS_NEW_OPTIONS,
+                key="items_new"
+            )
             
-        delivery_option = st.radio(
-            "What delivery option did you choose?",
-            delivery_options,
-            index=default_delivery_index,
-            key="delivery_option"
+            # Packaging impacts waste footprint
+            seed_widget("item_packaging", "consumption", "item_packaging", "Standard packaging", PACKAGING_OPTIONS)
+            item_packaging = st.radio(
+                "How was the packaging of these items?",
+                PACKAGING_OPTIONS,
+                key="item_packaging"
+            )
+        
+        # Delivery speed affects carbon footprint
+        if online_shopping:
+            seed_widget("delivery_option", "consumption", "delivery_option", "Standard", DELIVERY_OPTIONS)
+            delivery_option = st.radio(
+                "What delivery option did you choose?",
+                DELIVERY_OPTIONS,
+                key="delivery_option"
+            )
+        
+        # Waste management practices
+        st.subheader("Waste & Recycling")
+        
+        # Recycling percentage significantly impacts waste footprint
+        seed_widget("recycling", "waste", "recycling_percentage", 0)
+        recycling = st.slider(
+            "How much of your waste today did you recycle?", 
+            0, 100, 
+            help="Estimated percentage",
+            key="recycling"
         )
-        store_response("consumption", "delivery_option", delivery_option)
-    
-    # Waste management practices
-    st.subheader("Waste & Recycling")
-    
-    # Recycling percentage significantly impacts waste footprint
-    recycling = st.slider(
-        "How much of your waste today did you recycle?", 
-        0, 100, 
-        value=int(get_response("waste", "recycling_percentage", 0)),
-        help="Estimated percentage",
-        key="recycling"
-    )
-    store_response("waste", "recycling_percentage", recycling)
-    
-    # Composting reduces landfill methane emissions
-    composting = st.checkbox(
-        "Do you compost food waste?",
-        value=get_response("waste", "does_compost", False),
-        key="does_compost"
-    )
-    store_response("waste", "does_compost", composting)
-    
-    # Single-use plastics have high impact relative to their utility
-    plastic_usage = st.slider(
-        "How many single-use plastic items did you use today?", 
-        0, 20, 
-        value=int(get_response("waste", "single_use_plastic_count", 0)),
-        help="E.g., straws, bags, utensils, packaging",
-        key="plastic_usage"
-    )
-    store_response("waste", "single_use_plastic_count", plastic_usage)
-    
-    # Navigation buttons for this step
-    col1, col2, col3 = st.columns([1, 1, 5])
-    with col1:
-        if st.button("Previous", key="goods_prev", use_container_width=True):
+        
+        # Composting reduces landfill methane emissions
+        seed_widget("does_compost", "waste", "does_compost", False)
+        composting = st.checkbox(
+            "Do you compost food waste?",
+            key="does_compost"
+        )
+        
+        # Single-use plastics have high impact relative to their utility
+        seed_widget("plastic_usage", "waste", "single_use_plastic_count", 0)
+        plastic_usage = st.slider(
+            "How many single-use plastic items did you use today?", 
+            0, 20, 
+            help="E.g., straws, bags, utensils, packaging",
+            key="plastic_usage"
+        )
+        
+        # Navigation buttons submit the form, so answers are saved whichever way the user leaves
+        cols = st.columns([1, 1, 5])
+        previous = cols[0].form_submit_button("Previous", use_container_width=True)
+        submitted = cols[1].form_submit_button("Next: Food Invoice", use_container_width=True)
+    
+    if previous or submitted:
+        answers = {
+            ("waste", "recycling_percentage"): recycling,
+            ("waste", "does_compost"): composting,
+            ("waste", "single_use_plastic_count"): plastic_usage,
+        }
+        if made_purchases:
+            answers[("consumption", "items_new_or_used")] = items_new
+            answers[("consumption", "item_packaging")] = item_packaging
+        if online_shopping:
+            answers[("consumption", "delivery_option")] = delivery_option
+        store_responses(answers)
+        
+        # Decide once whether the food invoice step has anything to show
+        st.session_state.skip_invoice = not (
+            get_response("food", "has_lunch_invoice", False) or get_response("food", "has_dinner_invoice", False)
+        )
+        
+        if previous:
             prev_step()
-    with col2:
-        if st.button("Next: Food Invoice", key="goods_next", use_container_width=True):
+        else:
             next_step()
+        st.rerun()
 
 # Step 5: Food Invoice - Optional step for analyzing food delivery receipts
-elif st.session_state.current_step == 5:
+@st.fragment
+def step_food_invoice():
     st.header("Food Order Invoice")
     
-    # Check if user indicated they have a food delivery invoice
-    has_lunch_invoice = get_response("food", "has_lunch_invoice", False)
-    has_dinner_invoice = get_response("food", "has_dinner_invoice", False)
+    # Check which meals the user indicated they have a food delivery invoice for
+    invoice_meals = [meal for meal in ("lunch", "dinner") if get_response("food", f"has_{meal}_invoice", False)]
     
     # Only show upload if user has an invoice to analyze
-    if has_lunch_invoice or has_dinner_invoice:
+    if invoice_meals:
         st.info("You mentioned you have a food delivery invoice. Please upload it below for analysis.")
         
-        # File uploader component with type restrictions
-        uploaded_file = st.file_uploader(
-            "Upload your food order invoice", 
-            type=["jpg", "jpeg", "png", "pdf"],
-            key="invoice_upload"
-        )
+        # One uploader per meal so lunch and dinner receipts can be analyzed in a single request
+        invoice_bytes = {}
+        for meal in invoice_meals:
+            # File uploader component with type restrictions
+            uploaded_file = st.file_uploader(
+                f"Upload your {meal} order invoice", 
+                type=["jpg", "jpeg", "png", "pdf"],
+                key=f"{meal}_invoice_upload"
+            )
+            
+            # Process the uploaded file if available
+            if uploaded_file is not None:
+                # Currently only handling image files, not PDFs
+                if uploaded_file.type.startswith('image'):
+                    # Keep the image in memory rather than writing it to disk on every rerun
+                    invoice_bytes[meal] = uploaded_file.getvalue()
+                    
+                    # Display the image to the user
+                    st.image(invoice_bytes[meal], caption=f"Uploaded {meal.capitalize()} Invoice", use_container_width=True)
+                else:
+                    st.error("Please upload an image file of your invoice. PDF processing is not currently supported.")
         
-        # Process the uploaded file if available
-        if uploaded_file is not None:
-            # Currently only handling image files, not PDFs
-            if uploaded_file.type.startswith('image'):
-                # Save the uploaded file locally
-                with open("uploaded_invoice.png", "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                
-                # Display the image to the user
-                st.image("uploaded_invoice.png", caption="Uploaded Food Invoice", use_container_width=True)
+        # Provide button to show the analysis once at least one invoice is uploaded
+        if invoice_bytes:
+            # The analysis starts in the background on upload, so it is often ready before the button is clicked
+            invoice_future = start_invoice_analysis(
+                [(meal.capitalize(), image_bytes) for meal, image_bytes in invoice_bytes.items()]
+            )
+            analyze_button = st.button("Analyze Invoice", key="analyze_invoice")
+            if analyze_button:
+                # Show progress indicator
+                analysis_placeholder = st.empty()
+                analysis_placeholder.warning("Analyzing your food order... This may take up to 60 seconds.")
                 
-                # Provide button to trigger analysis
-                analyze_button = st.button("Analyze Invoice", key="analyze_invoice")
-                if analyze_button:
-                    # Show progress indicator
-                    analysis_placeholder = st.empty()
-                    analysis_placeholder.warning("Analyzing your food order... This may take up to 60 seconds.")
+                try:
+                    # Wait for Gemma 3's analysis of the receipt images, answered from cache for receipts seen before
+                    analyses = invoice_future.result(timeout=INVOICE_WAIT_SECONDS)
+                except FutureTimeoutError:
+                    # The analysis keeps running in the background, so clicking again picks up the same job
+                    analysis_placeholder.warning(
+                        "The analysis is taking longer than expected. Please click Analyze Invoice again in a moment."
+                    )
+                except OSError:
+                    analysis_placeholder.error("Failed to process the image. Please try another image.")
+                except Exception as e:
+                    analysis_placeholder.error(f"Error during analysis: {str(e)}")
+                else:
+                    invoice_analysis = "\n\n".join(
+                        f"### {label}\n\n{analysis}"
+                        for label, analysis in analyses.items()
+                    )
+                    st.session_state.food_order_analysis = invoice_analysis
                     
-                    # Encode and send the image for analysis
-                    base64_image = encode_image("uploaded_invoice.png")
-                    if base64_image:
-                        # Use Gemma 3 to analyze the receipt image
-                        invoice_analysis = analyze_food_invoice(base64_image)
-                        st.session_state.food_order_analysis = invoice_analysis
-                        
-                        # Update UI with success message
-                        analysis_placeholder.success("Analysis complete!")
-                        
-                        # Display the analysis results
-                        st.subheader("Food Order Analysis")
-                        st.markdown(invoice_analysis)
-                        
-                        # Store analysis in user responses
-                        store_response("food", "invoice_analysis", invoice_analysis)
-                    else:
-                        analysis_placeholder.error("Failed to process the image. Please try another image.")
-            else:
-                st.error("Please upload an image file of your invoice. PDF processing is not currently supported.")
+                    # Update UI with success message
+                    analysis_placeholder.success("Analysis complete!")
+                    
+                    # Display the analysis results
+                    st.subheader("Food Order Analysis")
+                    st.markdown(invoice_analysis)
+                    
+                    # Store analysis in user responses
+                    store_response("food", "invoice_analysis", invoice_analysis)
     else:
         st.info("You didn't mention having a food delivery invoice. You can proceed to the next step.")
     
     # Navigation buttons for this step
-    col1, col2, col3 = st.columns([1, 1, 5])
-    with col1:
-        if st.button("Previous", key="invoice_prev", use_container_width=True):
-            prev_step()
-    with col2:
-        if st.button("Next: Calculate Footprint", key="invoice_next", use_container_width=True):
-            next_step()
+    nav_bar(5, "Next: Calculate Footprint")
 
 # Step 6: Results - Final calculation and display of carbon footprint
-elif st.session_state.current_step == 6:
+@st.fragment
+def step_results():
     st.header("Your Carbon Footprint Results")
     
     # Option to recalculate if needed
@@ -883,45 +1484,76 @@ elif st.session_state.current_step == 6:
         st.markdown(st.session_state.food_order_analysis)
         st.markdown("---")
     
+    st.subheader("Overall Carbon Footprint Analysis")
+    
+    # A result calculated from different answers is stale and has to be recalculated
+    responses_json = serialized_responses()
+    results_key = llm_cache_key("final_result", responses_json)
+    if st.session_state.final_result_key != results_key:
+        st.session_state.final_result = None
+    
     # Calculate overall carbon footprint if not already done
     if st.session_state.final_result is None:
-        calculation_placeholder = st.empty()
-        calculation_placeholder.info("Preparing to calculate your overall carbon footprint...")
+        st.session_state.final_result_key = results_key
         
-        try:
-            # Show progress indicator during calculation
-            calculation_placeholder.warning("Calculating your carbon footprint... This may take up to 60 seconds.")
+        # Empty forms are rejected and sparse ones are estimated locally without calling the LLM
+        quick_result = quick_estimate(st.session_state.user_responses)
+        if not has_reported_activity(st.session_state.user_responses):
+            st.warning("Please fill in at least one section of the form so there is something to calculate.")
+        elif quick_result is not None:
+            st.session_state.final_result = quick_result
+            st.markdown(quick_result)
+        else:
+            calculation_placeholder = st.empty()
+            calculation_placeholder.info("Preparing to calculate your overall carbon footprint...")
             
-            # Send all user data to the AI for comprehensive analysis
-            result = analyze_with_gemma(st.session_state.user_responses)
-            st.session_state.final_result = result
+            try:
+                # Show progress indicator during calculation
+                calculation_placeholder.warning("Calculating your carbon footprint... This may take up to 60 seconds.")
             
-            # Update UI with success message
-            calculation_placeholder.success("Calculation complete!")
-        except Exception as e:
-            calculation_placeholder.error(f"Error during calculation: {str(e)}")
-            st.session_state.final_result = f"We encountered an error while calculating your carbon footprint: {str(e)}"
-    
-    # Display the comprehensive analysis results
-    st.subheader("Overall Carbon Footprint Analysis")
-    st.markdown(st.session_state.final_result)
+                # Send all user data to the AI for comprehensive analysis
+                # Cached results are shown at once, new ones are streamed as they are generated
+                if load_llm_result(analysis_cache_key(responses_json)) is not None:
+                    result = analyze_with_gemma(responses_json)
+                    st.markdown(result)
+                else:
+                    result = st.write_stream(stream_with_gemma(responses_json))
+                st.session_state.final_result = result
+            
+                # Update UI with success message
+                calculation_placeholder.success("Calculation complete!")
+            except Exception as e:
+                calculation_placeholder.error(f"Error during calculation: {str(e)}")
+                st.session_state.final_result = f"We encountered an error while calculating your carbon footprint: {str(e)}"
+                st.markdown(st.session_state.final_result)
+    else:
+        # Display the comprehensive analysis results
+        st.markdown(st.session_state.final_result)
     
     # Additional recommendations for next steps
     st.subheader("Next Steps")
-    st.markdown("""
-    - Track your footprint over time to see your progress
-    - Set goals to reduce your highest impact areas
-    - Share your journey with friends and family to inspire change
-    """)
+    st.markdown(NEXT_STEPS_MD)
     
     # Navigation and reset buttons
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Previous", key="results_prev", use_container_width=True):
             prev_step()
+            st.rerun()
     with col2:
         # Start over button clears all session state and reloads the app
         if st.button("Start Over", key="reset", use_container_width=True):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            st.session_state.clear()
             st.rerun()
+
+# Render only the current step
+# Each step is a fragment, so interacting with its widgets reruns just that step, not the whole script
+STEP_PAGES = {
+    1: step_transportation,
+    2: step_food,
+    3: step_home_energy,
+    4: step_consumer_goods,
+    5: step_food_invoice,
+    6: step_results,
+}
+STEP_PAGES[st.session_state.current_step]()